@@ -3,9 +3,13 @@ import pandas as pd
 import json
 import time
 import os
+import sys
 from io import BytesIO
 from google import genai
 from google.genai import types
+from dotenv import load_dotenv
+
+load_dotenv() # Lets MAX_INLINE_BYTES be set in .env, same as the CLI
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="Smart Bill Extractor", page_icon="🧾", layout="wide")
@@ -217,6 +221,10 @@ with st.sidebar:
     st.divider()
     st.warning("⚠️ **Rate Limit:** ~1500 Bills/Day (Free Tier)")
 
+    if st.session_state.get("peak_rss"):
+        peak_mb, run_increase_mb = st.session_state.peak_rss
+        st.caption(f"🧠 Server peak memory (RSS): {peak_mb:.1f} MB (+{run_increase_mb:.1f} MB during last run)")
+
 
 # --- SMART AI LOGIC ---
 # UPDATED MODEL LIST: Put 1.5-Flash first to solve quota issues
@@ -229,7 +237,63 @@ CANDIDATE_MODELS = [
     "gemini-3-flash"
 ]
 
-def get_working_model(client, file_bytes, mime_type, prompt):
+# --- MEMORY LIMITS ---
+# Note: Streamlit keeps every uploaded file in memory itself (limit: server.maxUploadSize).
+# We can't go below that, but we avoid making extra copies of it.
+GEMINI_INLINE_LIMIT = 20 * 1024 * 1024  # Gemini rejects inline requests above 20 MB
+UPLOAD_TIMEOUT_SECONDS = 120            # Give up on a Files API upload stuck in PROCESSING
+
+def read_inline_limit():
+    """MAX_INLINE_BYTES from the environment, clamped to Gemini's inline limit."""
+    default = 15 * 1024 * 1024
+    try:
+        value = int(os.getenv("MAX_INLINE_BYTES", default))
+    except ValueError:
+        return default
+    return max(0, min(value, GEMINI_INLINE_LIMIT))
+
+# Bills larger than this are sent through the Files API instead of inline bytes
+MAX_INLINE_BYTES = read_inline_limit()
+
+def get_peak_rss_mb():
+    """Peak memory of this process in MB (None where 'resource' is missing, e.g. Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def build_file_part(client, uploaded_file, mime_type):
+    """Small files go inline, large ones are uploaded and passed by reference."""
+    if uploaded_file.size <= MAX_INLINE_BYTES:
+        return types.Part.from_bytes(data=uploaded_file.getvalue(), mime_type=mime_type), None
+
+    # Upload straight from Streamlit's buffer - no bytes copy for large bills
+    uploaded_file.seek(0)
+    uploaded = client.files.upload(
+        file=uploaded_file,
+        config=types.UploadFileConfig(mime_type=mime_type)
+    )
+    try:
+        deadline = time.time() + UPLOAD_TIMEOUT_SECONDS
+        while getattr(uploaded.state, "name", uploaded.state) == "PROCESSING":
+            if time.time() > deadline:
+                raise TimeoutError("File upload is still processing after 2 minutes")
+            time.sleep(2)
+            uploaded = client.files.get(name=uploaded.name)
+        if getattr(uploaded.state, "name", uploaded.state) == "FAILED":
+            raise RuntimeError("Google could not process the uploaded file")
+    except Exception:
+        try:
+            client.files.delete(name=uploaded.name)
+        except Exception:
+            pass  # Keep the real error
+        raise
+    return types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type or mime_type), uploaded
+
+def get_working_model(client, file_part, prompt):
     """Tries multiple models until one works."""
     last_error = ""
     
@@ -240,7 +304,7 @@ def get_working_model(client, file_bytes, mime_type, prompt):
                 contents=[
                     types.Content(
                         parts=[
-                            types.Part.from_bytes(data=file_bytes, mime_type=mime_type),
+                            file_part,
                             types.Part.from_text(text=prompt)
                         ]
                     )
@@ -269,7 +333,7 @@ def get_working_model(client, file_bytes, mime_type, prompt):
 
     return None, last_error
 
-def process_bill(file_bytes, mime_type, api_key):
+def process_bill(uploaded_file, mime_type, api_key):
     client = genai.Client(api_key=api_key)
     
     prompt = """
@@ -290,7 +354,19 @@ def process_bill(file_bytes, mime_type, api_key):
     Return ONLY valid JSON.
     """
     
-    return get_working_model(client, file_bytes, mime_type, prompt)
+    try:
+        file_part, uploaded = build_file_part(client, uploaded_file, mime_type)
+    except Exception as e:
+        return None, f"Upload failed: {e}"
+
+    try:
+        return get_working_model(client, file_part, prompt)
+    finally:
+        if uploaded is not None:
+            try:
+                client.files.delete(name=uploaded.name)
+            except Exception:
+                pass
 
 
 # --- MAIN APP UI ---
@@ -387,14 +463,13 @@ if uploaded_files:
         
         tab1, tab2 = st.tabs(["📊 Live Data", "📋 Processing Logs"])
         
+        peak_before = get_peak_rss_mb()
+
         # Loop ONLY through NEW files
         for i, file in enumerate(new_files_to_process):
             status_text.write(f"🔄 Processing **{file.name}**...")
             
-            bytes_data = file.getvalue()
-            mime_type = file.type
-            
-            data, model_used = process_bill(bytes_data, mime_type, api_key)
+            data, model_used = process_bill(file, file.type, api_key)
             
             if data:
                 with tab2:
@@ -443,6 +518,10 @@ if uploaded_files:
             time.sleep(1) 
 
         status_text.write("🎉 **Processing Complete!**")
+        # The server's peak RSS only ever grows, so also show how much this run raised it
+        peak_after = get_peak_rss_mb()
+        if peak_after is not None:
+            st.session_state.peak_rss = (peak_after, peak_after - peak_before)
         
         # SAVE NEW RESULTS TO DB HISTORY
         if current_run_results:
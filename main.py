@@ -1,11 +1,16 @@
 import os
+import sys
 import time
 import json
+import hashlib
+import sqlite3
+import argparse
 import mimetypes
 import pandas as pd
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv        # This is only if you are using .env file to mask you API key
+from work_queue import WorkQueue
 
 # --- CONFIGURATION ---
 # API_KEY = "Give your API key from google AI studio"
@@ -16,12 +21,36 @@ load_dotenv() # Load variables from .env file
 API_KEY = os.getenv("GOOGLE_API_KEY")
 
 # SETUP CLIENT
-client = genai.Client(api_key=API_KEY)
+REQUEST_TIMEOUT_SECONDS = 300  # A hung Gemini request must not block a bill (and its lease) forever
+client = genai.Client(api_key=API_KEY, http_options=types.HttpOptions(timeout=REQUEST_TIMEOUT_SECONDS * 1000))
 
 # PATHS SETUP
 script_directory = os.path.dirname(os.path.abspath(__file__))
 INPUT_FOLDER = os.path.join(script_directory, "scanned_bills")      # This is folder or storing the images 
 OUTPUT_FILE = os.path.join(script_directory, "Final_Expenses.xlsx") # This is the output excel file
+# Shared queue for --worker / --merge. Keep it in the shared folder so every box uses the same one
+QUEUE_DB = os.getenv("BILL_QUEUE_DB", os.path.join(INPUT_FOLDER, ".bill_queue.db"))
+QUOTA_BACKOFF_SECONDS = 60  # How long a bill (and its worker) waits after a quota error
+QUEUE_RETRIES = 6           # Tries for a queue call before giving up (share offline / DB locked)
+
+# MEMORY LIMITS
+CHUNK_SIZE = 1024 * 1024                # Files are read/hashed 1 MB at a time
+GEMINI_INLINE_LIMIT = 20 * 1024 * 1024  # Gemini rejects inline requests above 20 MB
+UPLOAD_TIMEOUT_SECONDS = 120            # Give up on a Files API upload stuck in PROCESSING
+
+def read_inline_limit():
+    """MAX_INLINE_BYTES from .env, clamped to Gemini's inline limit"""
+    default = 15 * 1024 * 1024
+    try:
+        value = int(os.getenv("MAX_INLINE_BYTES", default))
+    except ValueError:
+        print(f"WARNING: MAX_INLINE_BYTES is not a number, using {default}")
+        return default
+    return max(0, min(value, GEMINI_INLINE_LIMIT))
+
+# Max bytes of a bill sent inline with a request. Bigger files go through the
+# Files API so only a reference is held in memory.
+MAX_INLINE_BYTES = read_inline_limit()
 
 
 def get_mime_type(file_path):
@@ -29,6 +58,61 @@ def get_mime_type(file_path):
     mime_type, _ = mimetypes.guess_type(file_path)
     return mime_type or "application/pdf"
 
+def hash_file(file_path):
+    """SHA-256 of a file, read in chunks so big scans never sit in memory"""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def get_peak_rss_mb():
+    """Peak memory of this process in MB (None where 'resource' is missing, e.g. Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class QuotaExceededError(Exception):
+    """A request failed with 429 - the bill itself may be fine"""
+
+def build_file_part(file_path, mime_type, file_size):
+    """Small files go inline, large ones are uploaded and passed by reference.
+    Returns (part, uploaded_file) - uploaded_file must be deleted when done."""
+    if file_size <= MAX_INLINE_BYTES:
+        with open(file_path, "rb") as f:
+            return types.Part.from_bytes(data=f.read(), mime_type=mime_type), None
+
+    try:
+        uploaded = client.files.upload(
+            file=file_path,
+            config=types.UploadFileConfig(mime_type=mime_type, display_name=os.path.basename(file_path))
+        )
+    except Exception as e:
+        if "429" in str(e):
+            raise QuotaExceededError(f"File upload failed (quota exceeded): {e}") from e
+        raise
+    try:
+        # Wait until Google has finished processing the upload
+        deadline = time.time() + UPLOAD_TIMEOUT_SECONDS
+        while getattr(uploaded.state, "name", uploaded.state) == "PROCESSING":
+            if time.time() > deadline:
+                raise TimeoutError("File upload is still processing after 2 minutes")
+            time.sleep(2)
+            uploaded = client.files.get(name=uploaded.name)
+        if getattr(uploaded.state, "name", uploaded.state) == "FAILED":
+            raise RuntimeError("Google could not process the uploaded file")
+    except Exception:
+        try:
+            client.files.delete(name=uploaded.name)
+        except Exception:
+            pass  # Keep the real error
+        raise
+    return types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type or mime_type), uploaded
+
 # --- UPDATED MODEL LIST (Based on your account) ---
 CANDIDATE_MODELS = [
     "gemini-2.5-flash",       # Best balance of Speed + Accuracy (Primary)
@@ -40,47 +124,63 @@ CANDIDATE_MODELS = [
 def get_working_model(file_path, prompt):
     # Detect proper MIME type
     mime_type = get_mime_type(file_path)
-    
-    with open(file_path, "rb") as f:
-        file_content = f.read()
+    file_size = os.path.getsize(file_path)
+    mode = "inline" if file_size <= MAX_INLINE_BYTES else "upload"
 
-    print(f"   (Size: {len(file_content)} bytes | Type: {mime_type})")
+    print(f"   (Size: {file_size} bytes | Type: {mime_type} | Mode: {mode})")
 
-    for model_name in CANDIDATE_MODELS:
-        print(f"Trying {model_name}...", end=" ")
-        try:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=[
-                    types.Content(
-                        parts=[
-                            types.Part.from_bytes(data=file_content, mime_type=mime_type),
-                            types.Part.from_text(text=prompt)
-                        ]
+    file_part, uploaded = build_file_part(file_path, mime_type, file_size)
+    quota_hit = False
+    try:
+        for model_name in CANDIDATE_MODELS:
+            print(f"Trying {model_name}...", end=" ")
+            try:
+                response = client.models.generate_content(
+                    model=model_name,
+                    contents=[
+                        types.Content(
+                            parts=[
+                                file_part,
+                                types.Part.from_text(text=prompt)
+                            ]
+                        )
+                    ],
+                    config=types.GenerateContentConfig(
+                        response_mime_type="application/json"
                     )
-                ],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json"
                 )
-            )
-            print("SUCCESSFULL!")
-            return json.loads(response.text), model_name
-        except Exception as e:
-            # Print the EXACT error so we can see it
-            if "429" in str(e):
-                print("QUOTA EXCEEDED (Wait or swap key)")
-            elif "503" in str(e):
-                print("OVERLOADED (Server busy)")
-            elif "404" in str(e):
-                print("NOT FOUND (Model name wrong)")
-            else:
-                print(f"ERROR: {str(e)[:100]}") # Print first 100 chars of error
-            continue
-    
+                print("SUCCESSFULL!")
+                return json.loads(response.text), model_name
+            except Exception as e:
+                # Print the EXACT error so we can see it
+                if "429" in str(e):
+                    quota_hit = True
+                    print("QUOTA EXCEEDED (Wait or swap key)")
+                elif "503" in str(e):
+                    print("OVERLOADED (Server busy)")
+                elif "404" in str(e):
+                    print("NOT FOUND (Model name wrong)")
+                else:
+                    print(f"ERROR: {str(e)[:100]}") # Print first 100 chars of error
+                continue
+    finally:
+        # Remove the remote copy as soon as this bill is done
+        if uploaded is not None:
+            try:
+                client.files.delete(name=uploaded.name)
+            except Exception:
+                pass
+
+    if quota_hit:
+        raise QuotaExceededError("All models failed to respond (quota exceeded).")
     raise Exception("All models failed to respond.")
 
-def process_bill(pdf_path):
-    print(f"   Processing: {os.path.basename(pdf_path)}")
+def process_bill(pdf_path, file_hash=None):
+    # Only worker mode needs the hash, and it passes it in - don't re-read the file for it
+    if file_hash:
+        print(f"   Processing: {os.path.basename(pdf_path)} (SHA256: {file_hash[:12]})")
+    else:
+        print(f"   Processing: {os.path.basename(pdf_path)}")
 
     prompt = """
     Extract invoice data into JSON:
@@ -92,10 +192,13 @@ def process_bill(pdf_path):
     """
 
    
-    data, used_model = get_working_model(pdf_path, prompt)
-    return data
+    return get_working_model(pdf_path, prompt)
 
-def save_to_excel(data):
+COLUMNS = ["Purchase From", "INVOICE", "GST NO", "DATE", "DESCRIPTION OF GOODS",
+           "HSN CODE", "QTY", "GST", "PRICE (inc Tax)", "AMOUNT (inc Tax)"]
+
+def build_rows(data):
+    """Turns one extracted bill into Excel rows (one per item)"""
     rows = []
     seller = data.get("seller_name", "").upper()
     inv = data.get("invoice_no", "")
@@ -115,15 +218,15 @@ def save_to_excel(data):
             "PRICE (inc Tax)": item.get("price_inc_tax"),
             "AMOUNT (inc Tax)": item.get("amount_inc_tax")
         })
+    return rows
 
+def save_to_excel(data):
+    rows = build_rows(data)
     if not rows: return
 
     df = pd.DataFrame(rows)
-    columns = ["Purchase From", "INVOICE", "GST NO", "DATE", "DESCRIPTION OF GOODS", 
-               "HSN CODE", "QTY", "GST", "PRICE (inc Tax)", "AMOUNT (inc Tax)"]
-    
     # Filter only columns that exist
-    df = df[[c for c in columns if c in df.columns]]
+    df = df[[c for c in COLUMNS if c in df.columns]]
 
     if os.path.exists(OUTPUT_FILE):
         # FIX: Changed engine to 'openpyxl' for appending
@@ -137,14 +240,153 @@ def save_to_excel(data):
         # For new files, simple write is fine
         df.to_excel(OUTPUT_FILE, index=False)
 
+def list_bills():
+    # Updated to find images too
+    return sorted(f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith(('.pdf', '.jpg', '.jpeg', '.png')))
+
+def register_bills(queue):
+    """Records every bill in the folder with its size and mtime (no file is read).
+    Returns how many are new or changed and still need hashing."""
+    files = []
+    for file_name in list_bills():
+        stat = os.stat(os.path.join(INPUT_FOLDER, file_name))
+        files.append((file_name, stat.st_size, int(stat.st_mtime)))
+    return queue.register(files)
+
+def hash_and_enqueue(queue, file_name):
+    """Hashes one claimed file and queues it. Workers do this between bills, so the
+    hashing is split between boxes and processing starts right away."""
+    try:
+        file_hash = hash_file(os.path.join(INPUT_FOLDER, file_name))
+    except FileNotFoundError:
+        queue_call(queue.forget, file_name)
+        return
+    except OSError as e:
+        # Share hiccup - the claim runs out and someone hashes it later
+        print(f"   Could not read {file_name} ({e}), skipping for now.")
+        return
+    queue_call(queue.enqueue, file_hash, file_name)
+
+def queue_call(func, *args):
+    """Runs a queue call, retrying with back-off if the shared DB is locked or the share drops out"""
+    for attempt in range(QUEUE_RETRIES):
+        try:
+            return func(*args)
+        except sqlite3.OperationalError as e:
+            if attempt == QUEUE_RETRIES - 1:
+                raise
+            wait = min(5 * 2 ** attempt, 60)
+            print(f"   Queue unavailable ({e}), retrying in {wait}s...")
+            time.sleep(wait)
+
+def run_worker(retry_failed=False):
+    """Distributed mode: lease bills from the shared queue until none are left"""
+    queue = queue_call(WorkQueue, QUEUE_DB)
+    print(f"Worker {queue.worker_id} | Queue: {QUEUE_DB}")
+    if retry_failed:
+        print(f"Requeued {queue_call(queue.retry_failed)} failed bills.")
+    print(f"Found {queue_call(register_bills, queue)} new or changed bills. Status: {queue_call(queue.counts)}")
+    print("-" * 40)
+
+    done = 0
+    while True:
+        # Hash at most one new file per bill processed
+        new_file = queue_call(queue.claim_unhashed)
+        if new_file:
+            hash_and_enqueue(queue, new_file)
+
+        job = queue_call(queue.lease)
+        if job is None:
+            if new_file:
+                continue # More files to hash
+            # Bills may be waiting out a quota back-off, or other workers may still
+            # crash and hand theirs back - wait for them
+            if queue_call(queue.has_open_work):
+                time.sleep(10)
+                continue
+            break
+
+        file_hash, file_name = job
+        print(f"Processing: {file_name}")
+        stop_heartbeat = queue.keep_alive(file_hash)
+        try:
+            try:
+                data, used_model = process_bill(os.path.join(INPUT_FOLDER, file_name), file_hash)
+            except QuotaExceededError as e:
+                # Not the bill's fault - hand it back without using an attempt and slow down
+                queue_call(queue.release, file_hash, e, QUOTA_BACKOFF_SECONDS)
+                print(f"\n   QUOTA HIT, requeued. Pausing {QUOTA_BACKOFF_SECONDS}s...")
+                time.sleep(QUOTA_BACKOFF_SECONDS)
+                continue
+            except Exception as e:
+                queue_call(queue.fail, file_hash, e)
+                print(f"\n   FAILED (will retry if attempts remain): {e}")
+            else:
+                # Keep retrying the save - the extraction already cost quota
+                queue_call(queue.complete, file_hash, file_name, data, used_model)
+                done += 1
+                print("Success!")
+        except sqlite3.OperationalError as e:
+            # The lease expires on its own, so another worker will pick the bill up
+            print(f"\n   Could not update the queue ({e}). The bill will be retried later.")
+        finally:
+            stop_heartbeat.set()
+
+        time.sleep(4) # Safety pause
+
+    print("-" * 40)
+    print(f"Worker finished {done} bills. Status: {queue_call(queue.counts)}")
+    print("Run 'python main.py --merge' to build the Excel file.")
+    peak_mb = get_peak_rss_mb()
+    if peak_mb is not None:
+        print(f"Peak memory (RSS): {peak_mb:.1f} MB")
+
+def merge_results():
+    """Writes every result in the shared history to a fresh Final_Expenses.xlsx"""
+    queue = queue_call(WorkQueue, QUEUE_DB)
+    print(f"Queue status: {queue_call(queue.counts)}")
+    unfinished = queue_call(queue.unfinished)
+    if unfinished:
+        print(f"WARNING: {len(unfinished)} bills are missing from the report:")
+        for file_name, status in unfinished:
+            print(f"   {file_name} ({status})")
+
+    rows = []
+    for _, data in queue_call(queue.results):
+        rows.extend(build_rows(data))
+    if not rows:
+        print("No results to merge yet.")
+        return
+
+    df = pd.DataFrame(rows)
+    df = df[[c for c in COLUMNS if c in df.columns]]
+    df.to_excel(OUTPUT_FILE, index=False)
+    print(f"DONE! Merged {len(rows)} rows into: {OUTPUT_FILE}")
+
 def main():
+    parser = argparse.ArgumentParser(description="Extract bills from the scanned_bills folder into Excel.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--worker", action="store_true",
+                      help="Distributed mode: share the work with other boxes through the queue file")
+    mode.add_argument("--merge", action="store_true",
+                      help="Build Final_Expenses.xlsx from the shared results of all workers")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="With --worker: put bills that ran out of attempts back in the queue")
+    args = parser.parse_args()
+    if args.retry_failed and not args.worker:
+        parser.error("--retry-failed only works together with --worker")
+
     if not os.path.exists(INPUT_FOLDER):
         os.makedirs(INPUT_FOLDER)
         print(f"Put bills in: {INPUT_FOLDER}")
         return
 
-    # Updated to find images too
-    files = [f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith(('.pdf', '.jpg', '.jpeg', '.png'))]
+    if args.merge:
+        return merge_results()
+    if args.worker:
+        return run_worker(retry_failed=args.retry_failed)
+
+    files = list_bills()
     print(f"Found {len(files)} bills.")
     print("-" * 40)
 
@@ -152,7 +394,7 @@ def main():
         print(f"Processing [{i+1}/{len(files)}]: {file_name}")
         try:
             full_path = os.path.join(INPUT_FOLDER, file_name)
-            data = process_bill(full_path)
+            data, _ = process_bill(full_path)
             save_to_excel(data)
             print("Success!")
         except Exception as e:
@@ -162,6 +404,9 @@ def main():
 
     print("-" * 40)
     print(f"DONE! File: {OUTPUT_FILE}")
+    peak_mb = get_peak_rss_mb()
+    if peak_mb is not None:
+        print(f"Peak memory (RSS): {peak_mb:.1f} MB")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The scripts live in the repo root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py builds its Gemini client at import time - tests stub every call on it
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
@@ -0,0 +1,130 @@
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+class FakeFiles:
+    """Stands in for client.files - records calls and returns canned File objects"""
+
+    def __init__(self, states=("ACTIVE",), upload_error=None, delete_error=None):
+        self.states = list(states)
+        self.upload_error = upload_error
+        self.delete_error = delete_error
+        self.uploaded = []
+        self.deleted = []
+
+    def _file(self):
+        return SimpleNamespace(name="files/1", uri="https://files/1", mime_type="application/pdf",
+                               state=SimpleNamespace(name=self.states.pop(0)))
+
+    def upload(self, file, config):
+        if self.upload_error:
+            raise self.upload_error
+        self.uploaded.append(file)
+        return self._file()
+
+    def get(self, name):
+        return self._file()
+
+    def delete(self, name):
+        self.deleted.append(name)
+        if self.delete_error:
+            raise self.delete_error
+
+
+@pytest.fixture
+def fake_files(monkeypatch):
+    def install(**kwargs):
+        files = FakeFiles(**kwargs)
+        monkeypatch.setattr(main, "client", SimpleNamespace(files=files))
+        monkeypatch.setattr(main.time, "sleep", lambda seconds: None)
+        return files
+    return install
+
+
+def test_hash_file_reads_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "CHUNK_SIZE", 7)
+    data = b"0123456789" * 10
+    bill = tmp_path / "bill.pdf"
+    bill.write_bytes(data)
+
+    assert main.hash_file(str(bill)) == hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, 15 * 1024 * 1024),
+    ("1000", 1000),
+    ("999999999", main.GEMINI_INLINE_LIMIT),
+    ("-5", 0),
+    ("lots", 15 * 1024 * 1024),
+])
+def test_read_inline_limit(monkeypatch, value, expected):
+    if value is None:
+        monkeypatch.delenv("MAX_INLINE_BYTES", raising=False)
+    else:
+        monkeypatch.setenv("MAX_INLINE_BYTES", value)
+
+    assert main.read_inline_limit() == expected
+
+
+def test_small_file_goes_inline(tmp_path, monkeypatch, fake_files):
+    files = fake_files()
+    monkeypatch.setattr(main, "MAX_INLINE_BYTES", 100)
+    bill = tmp_path / "bill.pdf"
+    bill.write_bytes(b"x" * 100)
+
+    part, uploaded = main.build_file_part(str(bill), "application/pdf", 100)
+
+    assert uploaded is None
+    assert part.inline_data.data == b"x" * 100
+    assert files.uploaded == []
+
+
+def test_large_file_is_uploaded(tmp_path, monkeypatch, fake_files):
+    files = fake_files(states=["PROCESSING", "ACTIVE"])
+    monkeypatch.setattr(main, "MAX_INLINE_BYTES", 10)
+    bill = tmp_path / "bill.pdf"
+    bill.write_bytes(b"x" * 100)
+
+    part, uploaded = main.build_file_part(str(bill), "application/pdf", 100)
+
+    assert files.uploaded == [str(bill)]
+    assert part.file_data.file_uri == "https://files/1"
+    assert uploaded.name == "files/1"
+
+
+def test_failed_upload_raises_and_cleans_up(tmp_path, monkeypatch, fake_files):
+    files = fake_files(states=["FAILED"], delete_error=RuntimeError("delete broke"))
+    monkeypatch.setattr(main, "MAX_INLINE_BYTES", 10)
+    bill = tmp_path / "bill.pdf"
+    bill.write_bytes(b"x" * 100)
+
+    # The delete error must not hide the real one
+    with pytest.raises(RuntimeError, match="could not process"):
+        main.build_file_part(str(bill), "application/pdf", 100)
+    assert files.deleted == ["files/1"]
+
+
+def test_upload_stuck_in_processing_times_out(tmp_path, monkeypatch, fake_files):
+    files = fake_files(states=["PROCESSING"] * 5)
+    monkeypatch.setattr(main, "MAX_INLINE_BYTES", 10)
+    monkeypatch.setattr(main, "UPLOAD_TIMEOUT_SECONDS", -1)
+    bill = tmp_path / "bill.pdf"
+    bill.write_bytes(b"x" * 100)
+
+    with pytest.raises(TimeoutError):
+        main.build_file_part(str(bill), "application/pdf", 100)
+    assert files.deleted == ["files/1"]
+
+
+def test_upload_quota_error_is_classified(tmp_path, monkeypatch, fake_files):
+    fake_files(upload_error=Exception("429 RESOURCE_EXHAUSTED"))
+    monkeypatch.setattr(main, "MAX_INLINE_BYTES", 10)
+    bill = tmp_path / "bill.pdf"
+    bill.write_bytes(b"x" * 100)
+
+    with pytest.raises(main.QuotaExceededError):
+        main.build_file_part(str(bill), "application/pdf", 100)
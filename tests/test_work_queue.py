@@ -0,0 +1,245 @@
+import sqlite3
+import time
+
+import pytest
+
+import work_queue
+from work_queue import WorkQueue
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "queue.db")
+
+
+def add_bill(q, file_hash, file_name, size=100):
+    q.register([(file_name, size, 0)])
+    return q.enqueue(file_hash, file_name)
+
+
+def lease_expiry(db_path):
+    conn = sqlite3.connect(db_path)
+    (expires,) = conn.execute("SELECT lease_expires FROM jobs").fetchone()
+    conn.close()
+    return expires
+
+
+def expire_leases(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE jobs SET lease_expires = 0 WHERE status = 'leased'")
+    conn.commit()
+    conn.close()
+
+
+def test_two_workers_never_get_the_same_lease(db_path):
+    a = WorkQueue(db_path, "a")
+    b = WorkQueue(db_path, "b")
+    for i in range(10):
+        add_bill(a, f"h{i}", f"bill{i}.pdf")
+
+    leased = []
+    while True:
+        got = [q.lease() for q in (a, b)]
+        if not any(got):
+            break
+        leased.extend(job[0] for job in got if job)
+
+    assert sorted(leased) == sorted(f"h{i}" for i in range(10))
+    assert a.counts() == {"leased": 10}
+
+
+def test_expired_lease_is_requeued(db_path):
+    crashed = WorkQueue(db_path, "crashed")
+    other = WorkQueue(db_path, "other")
+    crashed.enqueue("h1", "bill.pdf")
+
+    assert crashed.lease() == ("h1", "bill.pdf")
+    assert other.lease() is None
+
+    expire_leases(db_path)
+    assert other.lease() == ("h1", "bill.pdf")
+    # The crashed worker has lost the bill
+    assert crashed.heartbeat("h1") is False
+    assert other.heartbeat("h1") is True
+
+
+def test_expired_lease_with_short_lease_seconds(db_path, monkeypatch):
+    monkeypatch.setattr(work_queue, "LEASE_SECONDS", -1)
+    crashed = WorkQueue(db_path, "crashed")
+    other = WorkQueue(db_path, "other")
+    crashed.enqueue("h1", "bill.pdf")
+
+    crashed.lease()
+    assert other.lease() == ("h1", "bill.pdf")
+
+
+def test_bill_fails_after_max_attempts(db_path):
+    q = WorkQueue(db_path, "w")
+    q.enqueue("h1", "bill.pdf")
+
+    for attempt in range(work_queue.MAX_ATTEMPTS):
+        assert q.lease() == ("h1", "bill.pdf")
+        q.fail("h1", f"boom {attempt}")
+
+    assert q.lease() is None
+    assert q.counts() == {"failed": 1}
+    assert q.has_open_work() is False
+
+
+def test_repeated_crashes_end_in_failed(db_path):
+    q = WorkQueue(db_path, "w")
+    q.enqueue("h1", "bill.pdf")
+
+    for _ in range(work_queue.MAX_ATTEMPTS):
+        assert q.lease() is not None
+        expire_leases(db_path)
+
+    assert q.lease() is None
+    assert q.counts() == {"failed": 1}
+
+
+def test_fail_by_stale_worker_does_nothing(db_path):
+    stale = WorkQueue(db_path, "stale")
+    current = WorkQueue(db_path, "current")
+    stale.enqueue("h1", "bill.pdf")
+
+    stale.lease()
+    expire_leases(db_path)
+    current.lease()
+
+    stale.fail("h1", "late error")
+    stale.release("h1", "late quota error", 60)
+    assert current.counts() == {"leased": 1}
+    assert current.heartbeat("h1") is True
+
+
+def test_release_keeps_attempts_and_waits(db_path):
+    q = WorkQueue(db_path, "w")
+    q.enqueue("h1", "bill.pdf")
+
+    for _ in range(work_queue.MAX_ATTEMPTS + 2):
+        assert q.lease() == ("h1", "bill.pdf")
+        q.release("h1", "429", 0)
+
+    # Quota releases never use up attempts
+    q.lease()
+    q.fail("h1", "real error")
+    assert q.counts() == {"pending": 1}
+
+
+def test_release_delay_blocks_lease(db_path):
+    q = WorkQueue(db_path, "w")
+    q.enqueue("h1", "bill.pdf")
+
+    q.lease()
+    q.release("h1", "429", 60)
+    assert q.lease() is None
+    assert q.has_open_work() is True
+
+
+def test_retry_failed_requeues_bills(db_path):
+    q = WorkQueue(db_path, "w")
+    q.enqueue("h1", "bill.pdf")
+    for _ in range(work_queue.MAX_ATTEMPTS):
+        q.lease()
+        q.fail("h1", "boom")
+
+    assert q.retry_failed() == 1
+    assert q.lease() == ("h1", "bill.pdf")
+
+
+def test_results_round_trip(db_path):
+    q = WorkQueue(db_path, "w")
+    data = {"seller_name": "Shop", "items": [{"description": "Pen", "qty": 2}]}
+    add_bill(q, "h2", "b.pdf")
+    add_bill(q, "h1", "a.pdf")
+
+    for _ in range(2):
+        file_hash, file_name = q.lease()
+        q.complete(file_hash, file_name, data, "gemini-2.5-flash")
+
+    assert q.results() == [("a.pdf", data), ("b.pdf", data)]
+    assert q.counts() == {"done": 2}
+    assert q.unfinished() == []
+
+
+def test_duplicate_scan_is_only_queued_once(db_path):
+    q = WorkQueue(db_path, "w")
+
+    assert add_bill(q, "h1", "bill.pdf") is True
+    assert add_bill(q, "h1", "bill copy.pdf") is False
+    assert q.counts() == {"pending": 1}
+    # Both names are hashed, so neither is handed out for hashing again
+    assert q.register([("bill.pdf", 100, 0), ("bill copy.pdf", 100, 0)]) == 0
+    assert q.claim_unhashed() is None
+
+
+def test_register_only_rehashes_new_or_changed_files(db_path):
+    q = WorkQueue(db_path, "w")
+    add_bill(q, "old", "bill.pdf")
+
+    assert q.register([("bill.pdf", 100, 0), ("new.pdf", 5, 0)]) == 1
+    assert q.claim_unhashed() == "new.pdf"
+
+    # Same name, new content
+    assert q.register([("bill.pdf", 200, 0)]) == 1
+    assert q.claim_unhashed() == "bill.pdf"
+    q.enqueue("new content", "bill.pdf")
+    assert q.counts() == {"pending": 2}
+
+
+def test_replaced_file_drops_old_result(db_path):
+    q = WorkQueue(db_path, "w")
+    add_bill(q, "old", "bill.pdf")
+    q.complete(*q.lease(), {"items": []}, "m")
+
+    add_bill(q, "new", "bill.pdf", size=200)
+    assert q.results() == []
+    assert q.unfinished() == [("bill.pdf", "pending")]
+
+
+def test_two_workers_split_the_hashing(db_path):
+    a = WorkQueue(db_path, "a")
+    b = WorkQueue(db_path, "b")
+    a.register([("one.pdf", 1, 0), ("two.pdf", 2, 0)])
+
+    assert {a.claim_unhashed(), b.claim_unhashed()} == {"one.pdf", "two.pdf"}
+    assert a.claim_unhashed() is None
+    assert a.has_open_work() is True
+    assert sorted(a.unfinished()) == [("one.pdf", "not hashed"), ("two.pdf", "not hashed")]
+
+
+def test_forget_drops_vanished_file(db_path):
+    q = WorkQueue(db_path, "w")
+    q.register([("gone.pdf", 1, 0)])
+
+    q.forget(q.claim_unhashed())
+    assert q.has_open_work() is False
+
+
+def test_heartbeat_renews_lease(db_path, monkeypatch):
+    monkeypatch.setattr(work_queue, "HEARTBEAT_SECONDS", 0.01)
+    q = WorkQueue(db_path, "w")
+    add_bill(q, "h1", "bill.pdf")
+    q.lease()
+    before = lease_expiry(db_path)
+
+    stop = q.keep_alive("h1")
+    time.sleep(0.1)
+    stop.set()
+    assert lease_expiry(db_path) > before
+
+
+def test_heartbeat_stops_after_max_hold(db_path, monkeypatch):
+    monkeypatch.setattr(work_queue, "HEARTBEAT_SECONDS", 0.01)
+    monkeypatch.setattr(work_queue, "MAX_HOLD_SECONDS", 0)
+    q = WorkQueue(db_path, "w")
+    add_bill(q, "h1", "bill.pdf")
+    q.lease()
+    before = lease_expiry(db_path)
+
+    stop = q.keep_alive("h1")
+    time.sleep(0.1)
+    stop.set()
+    # A stuck worker lets the lease run out, so another worker can take the bill
+    assert lease_expiry(db_path) == before
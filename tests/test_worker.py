@@ -0,0 +1,156 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import main
+import work_queue
+from work_queue import WorkQueue
+
+BILL = {"seller_name": "shop", "invoice_no": "1", "items": [{"description": "Pen", "qty": 2}]}
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    bills = tmp_path / "scanned_bills"
+    bills.mkdir()
+    monkeypatch.setattr(main, "INPUT_FOLDER", str(bills))
+    monkeypatch.setattr(main, "QUEUE_DB", str(tmp_path / "queue.db"))
+    monkeypatch.setattr(main, "OUTPUT_FILE", str(tmp_path / "out.xlsx"))
+    return bills
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main.time, "sleep", calls.append)
+    return calls
+
+
+def stub_process_bill(monkeypatch, *outcomes):
+    """process_bill returns/raises the given outcomes in order, then keeps succeeding"""
+    outcomes = list(outcomes)
+    calls = []
+
+    def process_bill(path, file_hash=None):
+        calls.append(path)
+        outcome = outcomes.pop(0) if outcomes else BILL
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome, "gemini-test"
+
+    monkeypatch.setattr(main, "process_bill", process_bill)
+    return calls
+
+
+def test_worker_processes_every_bill_once(folder, sleeps, monkeypatch):
+    (folder / "a.pdf").write_bytes(b"a")
+    (folder / "b.pdf").write_bytes(b"b")
+    (folder / "b copy.pdf").write_bytes(b"b")
+    calls = stub_process_bill(monkeypatch)
+
+    main.run_worker()
+
+    assert len(calls) == 2
+    assert WorkQueue(main.QUEUE_DB).counts() == {"done": 2}
+
+
+def test_quota_error_requeues_without_using_attempts(folder, sleeps, monkeypatch):
+    (folder / "a.pdf").write_bytes(b"a")
+    monkeypatch.setattr(main, "QUOTA_BACKOFF_SECONDS", 0)
+    quota = [main.QuotaExceededError("429")] * (work_queue.MAX_ATTEMPTS + 2)
+    calls = stub_process_bill(monkeypatch, *quota)
+
+    main.run_worker()
+
+    assert len(calls) == work_queue.MAX_ATTEMPTS + 3
+    assert WorkQueue(main.QUEUE_DB).counts() == {"done": 1}
+    # The worker pauses after each quota hit
+    assert sleeps.count(0) == len(quota)
+
+
+def test_other_errors_end_in_failed(folder, sleeps, monkeypatch):
+    (folder / "a.pdf").write_bytes(b"a")
+    calls = stub_process_bill(monkeypatch, *[ValueError("bad json")] * 10)
+
+    main.run_worker()
+
+    assert len(calls) == work_queue.MAX_ATTEMPTS
+    assert WorkQueue(main.QUEUE_DB).counts() == {"failed": 1}
+
+
+def test_queue_call_retries_then_succeeds(sleeps):
+    results = [sqlite3.OperationalError("locked"), sqlite3.OperationalError("locked"), "ok"]
+
+    def flaky():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert main.queue_call(flaky) == "ok"
+    assert sleeps == [5, 10]
+
+
+def test_queue_call_gives_up(sleeps):
+    def broken():
+        raise sqlite3.OperationalError("share offline")
+
+    with pytest.raises(sqlite3.OperationalError):
+        main.queue_call(broken)
+    assert len(sleeps) == main.QUEUE_RETRIES - 1
+    assert max(sleeps) == 60
+
+
+def test_complete_is_retried_not_reprocessed(folder, sleeps, monkeypatch):
+    (folder / "a.pdf").write_bytes(b"a")
+    calls = stub_process_bill(monkeypatch)
+    real_complete = WorkQueue.complete
+    failures = [sqlite3.OperationalError("locked")] * 2
+
+    def flaky_complete(self, *args):
+        if failures:
+            raise failures.pop(0)
+        return real_complete(self, *args)
+
+    monkeypatch.setattr(WorkQueue, "complete", flaky_complete)
+    main.run_worker()
+
+    assert len(calls) == 1
+    assert WorkQueue(main.QUEUE_DB).counts() == {"done": 1}
+
+
+def test_worker_survives_queue_giving_up(folder, sleeps, monkeypatch):
+    (folder / "a.pdf").write_bytes(b"a")
+    # Leases run out at once, so the bill is picked up again after the failed save
+    monkeypatch.setattr(work_queue, "LEASE_SECONDS", -1)
+    calls = stub_process_bill(monkeypatch)
+    real_complete = WorkQueue.complete
+    failures = [sqlite3.OperationalError("locked")] * main.QUEUE_RETRIES
+
+    def flaky_complete(self, *args):
+        if failures:
+            raise failures.pop(0)
+        return real_complete(self, *args)
+
+    monkeypatch.setattr(WorkQueue, "complete", flaky_complete)
+    main.run_worker()
+
+    assert len(calls) == 2
+    assert WorkQueue(main.QUEUE_DB).counts() == {"done": 1}
+
+
+def test_merge_writes_rows_and_lists_missing_bills(folder, sleeps, monkeypatch, capsys):
+    (folder / "a.pdf").write_bytes(b"a")
+    (folder / "b.pdf").write_bytes(b"b")
+    stub_process_bill(monkeypatch, BILL, *[ValueError("bad json")] * 10)
+    main.run_worker()
+    capsys.readouterr()
+
+    main.merge_results()
+
+    out = capsys.readouterr().out
+    assert "b.pdf (failed)" in out
+    df = pd.read_excel(main.OUTPUT_FILE)
+    assert list(df["Purchase From"]) == ["SHOP"]
+    assert list(df["DESCRIPTION OF GOODS"]) == ["Pen"]
@@ -0,0 +1,269 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# --- QUEUE SETTINGS ---
+LEASE_SECONDS = 300     # A bill goes back to the queue if its worker stops heartbeating for this long
+HEARTBEAT_SECONDS = 60  # How often a busy worker renews its lease
+MAX_HOLD_SECONDS = 3 * LEASE_SECONDS  # Stop renewing after this long - the worker is probably stuck
+MAX_ATTEMPTS = 3        # After this many tries a bill is marked as failed (quota waits don't count)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    hash          TEXT PRIMARY KEY,
+    file_name     TEXT NOT NULL,
+    status        TEXT NOT NULL DEFAULT 'pending',   -- pending / leased / done / failed
+    worker        TEXT,
+    lease_expires REAL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    last_error    TEXT,
+    not_before    REAL                               -- don't lease before this time (quota back-off)
+);
+CREATE INDEX IF NOT EXISTS jobs_file_name ON jobs (file_name);
+-- Every file seen in the folder, including duplicate scans of a queued bill.
+-- hash is NULL until a worker claims and hashes the file.
+CREATE TABLE IF NOT EXISTS names (
+    file_name     TEXT PRIMARY KEY,
+    size          INTEGER NOT NULL,
+    mtime         INTEGER NOT NULL,
+    hash          TEXT,
+    claimed_by    TEXT,
+    claimed_until REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    hash        TEXT PRIMARY KEY,
+    file_name   TEXT NOT NULL,
+    model       TEXT,
+    worker      TEXT,
+    data        TEXT NOT NULL,
+    finished_at REAL NOT NULL
+);
+"""
+
+
+def make_worker_id():
+    """Unique name for this worker, e.g. 'office-pc-4120'"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """Shared bill queue + result history stored in one SQLite file.
+
+    Put the file in the shared folder so every box sees the same queue.
+    Bills are keyed by content hash, so the same scan is only processed once
+    even if it is copied under another name.
+    """
+
+    def __init__(self, db_path, worker_id=None):
+        self.db_path = db_path
+        self.worker_id = worker_id or make_worker_id()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # isolation_level=None = autocommit, so we can run our own BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't lease the same bill
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def register(self, files):
+        """Records the bills in the folder as (file_name, size, mtime) tuples. Cheap - nothing is read.
+        A file whose size or mtime changed is hashed again. Returns how many are new or changed."""
+        with self._transaction() as conn:
+            cur = conn.executemany(
+                "INSERT INTO names (file_name, size, mtime) VALUES (?, ?, ?) "
+                "ON CONFLICT (file_name) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, "
+                "hash = NULL, claimed_by = NULL, claimed_until = NULL "
+                "WHERE size != excluded.size OR mtime != excluded.mtime",
+                files
+            )
+        return cur.rowcount
+
+    def claim_unhashed(self):
+        """Claims a registered file nobody has hashed yet, so workers split the hashing.
+        Returns the file name or None."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT file_name FROM names WHERE hash IS NULL "
+                "AND (claimed_until IS NULL OR claimed_until < ?) ORDER BY file_name LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE names SET claimed_by = ?, claimed_until = ? WHERE file_name = ?",
+                    (self.worker_id, now + LEASE_SECONDS, row[0])
+                )
+        return row[0] if row else None
+
+    def forget(self, file_name):
+        """Drops a file that disappeared from the folder before it was hashed"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM names WHERE file_name = ? AND hash IS NULL", (file_name,))
+
+    def enqueue(self, file_hash, file_name):
+        """Stores the hash of a registered file and queues the bill.
+        Returns False if this content is already queued (e.g. a duplicate scan)."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE names SET hash = ?, claimed_by = NULL, claimed_until = NULL WHERE file_name = ?",
+                (file_hash, file_name)
+            )
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO jobs (hash, file_name) VALUES (?, ?)",
+                (file_hash, file_name)
+            )
+        return cur.rowcount == 1
+
+    def lease(self):
+        """Claims the next free bill. Returns (hash, file_name) or None if nothing is free."""
+        now = time.time()
+        with self._transaction() as conn:
+            # Leases that ran out belong to crashed workers - give up on bills that keep crashing
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', last_error = 'Lease expired too many times' "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS)
+            )
+            row = conn.execute(
+                "SELECT hash, file_name FROM jobs "
+                "WHERE (status = 'pending' AND (not_before IS NULL OR not_before <= ?)) "
+                "OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY attempts, file_name LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, not_before = NULL "
+                    "WHERE hash = ?",
+                    (self.worker_id, now + LEASE_SECONDS, row[0])
+                )
+        return row
+
+    def heartbeat(self, file_hash):
+        """Pushes our lease forward. Returns False if another worker has taken the bill."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE hash = ? AND worker = ? AND status = 'leased'",
+                (time.time() + LEASE_SECONDS, file_hash, self.worker_id)
+            )
+        return cur.rowcount == 1
+
+    def keep_alive(self, file_hash):
+        """Starts a background heartbeat. Call .set() on the returned event to stop it.
+        Renewals stop after MAX_HOLD_SECONDS, so a hung worker can't hold a bill forever."""
+        stop = threading.Event()
+        started = time.time()
+
+        def beat():
+            while not stop.wait(HEARTBEAT_SECONDS):
+                if time.time() - started > MAX_HOLD_SECONDS:
+                    return
+                try:
+                    if not self.heartbeat(file_hash):
+                        return
+                except sqlite3.Error:
+                    pass  # Share briefly unavailable - try again next beat
+
+        threading.Thread(target=beat, daemon=True).start()
+        return stop
+
+    def complete(self, file_hash, file_name, data, model):
+        """Saves the extracted data to the shared history and marks the bill done"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (hash, file_name, model, worker, data, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_hash, file_name, model, self.worker_id, json.dumps(data), time.time())
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'done', worker = ?, lease_expires = NULL, last_error = NULL "
+                "WHERE hash = ?",
+                (self.worker_id, file_hash)
+            )
+
+    def fail(self, file_hash, error):
+        """Puts the bill back in the queue, or marks it failed once it is out of attempts"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker = NULL, lease_expires = NULL, last_error = ? "
+                "WHERE hash = ? AND worker = ? AND status = 'leased'",
+                (MAX_ATTEMPTS, str(error)[:500], file_hash, self.worker_id)
+            )
+
+    def release(self, file_hash, error, delay):
+        """Hands the bill back without using up an attempt (e.g. quota hit).
+        No worker may lease it again for `delay` seconds."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0), "
+                "worker = NULL, lease_expires = NULL, last_error = ?, not_before = ? "
+                "WHERE hash = ? AND worker = ? AND status = 'leased'",
+                (str(error)[:500], time.time() + delay, file_hash, self.worker_id)
+            )
+
+    def retry_failed(self):
+        """Puts every failed bill back in the queue with fresh attempts. Returns how many."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, worker = NULL, "
+                "lease_expires = NULL, not_before = NULL WHERE status = 'failed'"
+            )
+        return cur.rowcount
+
+    def has_open_work(self):
+        """True while files still need hashing, bills are waiting (maybe on a quota back-off)
+        or other workers hold bills - they may still crash and hand them back"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM names WHERE hash IS NULL "
+                "UNION ALL SELECT 1 FROM jobs WHERE status IN ('pending', 'leased') LIMIT 1"
+            ).fetchone()
+        return row is not None
+
+    def counts(self):
+        """Number of bills in each status, e.g. {'done': 40, 'pending': 3}"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def unfinished(self):
+        """Bills in the folder that have no result, as (file_name, status) pairs"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT names.file_name, COALESCE(jobs.status, 'not hashed') FROM names "
+                "LEFT JOIN jobs ON jobs.hash = names.hash "
+                "WHERE jobs.status IS NULL OR jobs.status != 'done' ORDER BY names.file_name"
+            ).fetchall()
+        return rows
+
+    def results(self):
+        """Extracted bills as (file_name, data) pairs, ordered by file name.
+        Results for old versions of a replaced file are left out."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT file_name, data FROM results WHERE hash IN (SELECT hash FROM names) "
+                "ORDER BY file_name"
+            ).fetchall()
+        return [(name, json.loads(data)) for name, data in rows]